@@ -4,23 +4,276 @@ DataFrames containing filesystem statistics for all files under those directorie
 """
 from __future__ import annotations
 import argparse
+import multiprocessing
 import os
+import stat
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
-from datetime import datetime
+from dateutil.tz import tzlocal
 import pandas as pd
 import sys
 import re
+import queue
+import threading
 from git import Repo,InvalidGitRepositoryError
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 VERBOSE = False
+# Cached git-repo data (tracked, locally-modified, staged file sets) for the
+# module being scanned; set in each worker process by init_scan_worker
+GIT_FILES = (None, None, None)
+
+# Content-parse patterns, run over whole buffers of undecoded lines
+RE_COPYRIGHT = re.compile(rb'Copyright|All rights reserved|Use, modification|software is limit', re.IGNORECASE)
+# Classifies each line that is of interest by which named group matched:
+#   blank    - empty or whitespace-only
+#   comment  - first non-blank character is '#'
+#   trailing - code with a comment appended at the end, per
+#              European Cooperation for Space Standardization (ECSS)
+RE_LINE_KIND = re.compile(rb'^[^\S\n]*(?:(?P<blank>$)'
+                          rb'|(?P<comment>#.*)'
+                          rb'|(?P<trailing>[^#\s][^#\n]*#+(?:[^\w\s]|[^\S\n]+\S)))', re.MULTILINE)
+# Statements of interest, fused into one alternation; the named group that
+# matched (m.lastgroup) says which counter to bump. Matches stay within one
+# line ([^\S\n] between tokens), so counts do not depend on how a file is
+# split into buffers
+RE_ALL = re.compile(rb'(?P<func>\bfunction[^\S\n]+\w+\()'
+                    rb'|(?P<prep>\bprepare[^\S\n]+\w+[^\S\n]+from)'
+                    rb'|(?P<exec>\bexecute[^\S\n]+\w+[^\S\n]+using)'
+                    rb'|(?P<run>\brun\s)'
+                    rb'|(?P<mz>\bmz\s)', re.IGNORECASE)
+
+# Define "plaintext files" by suffix (lower-case, as compared)
+PLAINTEXT_SUFFIXES = frozenset({'.4gl', '.ext', '.org', '.sql', '.set', '.rds',
+    '.txt', '.md', '.csv', '.json', '.yaml', '.yml', '.ini', '.cfg',
+    '.py', '.pl', '.sh', '.bash', '.ksh', '.c', '.h', '.cpp', '.hpp',
+    '.js', '.ts', '.html', '.css', '.xml', '.bat', '.cmd', '.php'})
+
+# Columns of the stats DataFrame, in the order scan_one returns them
+COLUMNS = (
+    "abs_path",
+    "rel_path",
+    "parent",
+    "name",
+    "suffix",
+    "size_bytes",
+    "mtime",
+    "ctime",
+    "atime",
+    "mode_octal",
+    "uid",
+    "gid",
+    "num_lines",
+    "num_comment_lines",
+    "num_blank_lines",
+    "num_function_defines",
+    "num_prepare_defines",
+    "num_execute_statements",
+    "num_run_statements",
+    "num_mz_statements",
+    "b_tracked_in_scm_repo",
+    "b_locally_modified",
+    "b_staged_for_commit",
+)
+
+# Permission-bit strings for every st_mode & 0o777 value, indexed by that value
+OCT_TABLE = tuple(oct(i) for i in range(0o1000))
+
+# Files smaller than this are read in one go; larger ones in chunks
+SLURP_MAX_BYTES = 8 * 1024 * 1024
+READ_CHUNK_BYTES = 256 * 1024
+# Leading bytes checked for a NUL before a file is content-parsed
+BINARY_PROBE_BYTES = 512
+
+# Rows per Parquet row group; bounds the Arrow memory used per write
+PARQUET_ROW_GROUP_ROWS = 128 * 1024
+
+# Walked-but-unscanned files allowed to queue up, and files per worker task
+WALK_QUEUE_DEPTH = 1024
+SCAN_BATCH_FILES = 64
 
 def vlog(*args, **kwargs):
     "Verbose print to stderr when VERBOSE is enabled."
     if VERBOSE:
         print(*args, file=sys.stderr, **kwargs)
 
-def iso(ts: float) -> str:
-    return datetime.fromtimestamp(ts).isoformat()
+def read_line_blocks(f, size: int, head: bytes = b''):
+    """Yield the contents of binary file f as buffers of whole lines; head is
+    any leading data already read from f."""
+    if size < SLURP_MAX_BYTES:
+        yield head + f.read()
+        return
+    tail = head
+    while chunk := f.read(READ_CHUNK_BYTES):
+        buf = tail + chunk
+        cut = buf.rfind(b'\n') + 1
+        if cut:
+            yield buf[:cut]
+        tail = buf[cut:]
+    if tail:
+        yield tail
+
+def count_content(data: bytes, counts: dict):
+    "Add line and statement counts for a buffer of whole lines into counts."
+    if not data:
+        return
+    ends_with_newline = data.endswith(b'\n')
+    counts["lines"] += data.count(b'\n') + (not ends_with_newline)
+    for m in RE_LINE_KIND.finditer(data):
+        kind = m.lastgroup
+        if kind == "comment":
+            text = m.group("comment").rstrip()
+            # Considering Copyright-related lines as "blank", not "comment"
+            # Considering lines with just # as "blank"
+            if RE_COPYRIGHT.search(text) or not text.lstrip(b'#'):
+                kind = "blank"
+        elif kind == "trailing":
+            kind = "comment"
+        counts[kind] += 1
+    # The position after a final newline matches as a blank "line"
+    if ends_with_newline:
+        counts["blank"] -= 1
+    # XXX   Refactor to categorize the kinds of statements
+    #       (auth, time-consuming, risk, etc.), and allow
+    #       them to be configurable
+    for m in RE_ALL.finditer(data):
+        counts[m.lastgroup] += 1
+
+def init_scan_worker(verbose: bool, tracked, local_mod, staged):
+    "Process-pool initializer: hand each worker the cached git-repo data."
+    global VERBOSE, GIT_FILES
+    VERBOSE = verbose
+    GIT_FILES = (tracked, local_mod, staged)
+
+def scan_mp_context():
+    "Start method for the scan pool: forkserver where the platform has it, else spawn."
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+def walk_files(top: str, rel_dir: str = ""):
+    """Yield (abs_path, rel_dir, name, stat_result) for regular files under top,
+    recursing into subdirectories; rel_dir is tracked relative to the starting top."""
+    try:
+        it = os.scandir(top)
+    except OSError as e:
+        vlog(f"skipping unreadable directory: {top} ({e})")
+        return
+    with it:
+        for entry in it:
+            # Following block only involves info in filesystem metadata (FAT).
+            # is_dir() comes from the directory read itself where the
+            # filesystem reports entry types, else from an lstat that
+            # DirEntry caches, so stat() below is at most one syscall
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from walk_files(entry.path, rel_dir + os.sep + entry.name if rel_dir else entry.name)
+                    continue
+                st = entry.stat(follow_symlinks=False)
+            except OSError as e:
+                # skip unreadable entries
+                vlog(f"skipping unreadable entry: {entry.path} ({e})")
+                continue
+            if stat.S_ISREG(st.st_mode):
+                yield entry.path, rel_dir, entry.name, st
+
+def queue_files(top: str, files: queue.Queue):
+    "Walker thread: put walk_files tuples on files, then a None sentinel."
+    try:
+        for file in walk_files(top):
+            files.put(file)
+    finally:
+        files.put(None)
+
+def queued_batches(files: queue.Queue):
+    "Yield lists of up to SCAN_BATCH_FILES tuples from files until the sentinel."
+    batch = []
+    while (file := files.get()) is not None:
+        batch.append(file)
+        if len(batch) == SCAN_BATCH_FILES:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def suffix_of(name: str) -> str:
+    "File suffix of name, as Path.suffix would give it."
+    i = name.rfind('.')
+    return name[i:] if 0 < i < len(name) - 1 else ''
+
+def scan_one(file: tuple):
+    "Return the COLUMNS values for a walk_files tuple."
+    tracked, local_mod, staged = GIT_FILES
+    abs_path, rel_dir, name, st = file
+
+    # Following block involves info against cached git-repo data, which is
+    # keyed by absolute path
+    b_tracked = False
+    if(tracked is not None and abs_path in tracked):
+        b_tracked = True
+
+    b_local_mod = False
+    if(local_mod is not None and abs_path in local_mod):
+        b_local_mod = True
+
+    b_staged = False
+    if(staged is not None and abs_path in staged):
+        b_staged = True
+
+    # Following block involves a full content-parse (intensive)
+    counts = dict.fromkeys(["lines", "comment", "blank", *RE_ALL.groupindex], 0)
+    suffix = suffix_of(name)
+    # Empty files have nothing to count, so are not opened at all
+    if st.st_size and (suffix.lower() in PLAINTEXT_SUFFIXES or name == "Makefile"):
+        try:
+            with open(abs_path, "rb", buffering=READ_CHUNK_BYTES) as f:
+                head = f.read(BINARY_PROBE_BYTES)
+                # A NUL byte up front means binary content behind a plaintext
+                # suffix (e.g. R data in an .RDS); leave its counts at zero
+                if b'\0' in head:
+                    vlog(f"not counting lines in binary-looking {abs_path}")
+                else:
+                    for block in read_line_blocks(f, st.st_size, head):
+                        count_content(block, counts)
+        except Exception as e:
+            vlog(f"could not count lines in {abs_path}: {e}")
+
+    return (
+        abs_path,
+        rel_dir + os.sep + name if rel_dir else name,
+        rel_dir or ".",
+        name,
+        suffix,
+        st.st_size,
+        st.st_mtime_ns,
+        st.st_ctime_ns,
+        st.st_atime_ns,
+        OCT_TABLE[st.st_mode & 0o777],
+        st.st_uid,
+        st.st_gid,
+        counts["lines"],
+        counts["comment"],
+        counts["blank"],
+        counts["func"],
+        counts["prep"],
+        counts["exec"],
+        counts["run"],
+        counts["mz"],
+        b_tracked,
+        b_local_mod,
+        b_staged,
+    )
+
+def scan_batch(files: list) -> list:
+    """Worker task: scan_one over a batch of files, returned column-wise (one
+    tuple of values per COLUMNS entry), transposed by zip() in C."""
+    return list(zip(*map(scan_one, files)))
+
+def extend_columns(columns: list, batch: list):
+    "Extend the per-column lists with a scan_batch result."
+    for column, values in zip(columns, batch):
+        column.extend(values)
 
 def gather_stats(root: Path, no_git:bool=False):
     root = root.resolve()
@@ -34,139 +287,120 @@ def gather_stats(root: Path, no_git:bool=False):
             vlog(f"No repo found in parent directories, continuing on")
 
     all_local_mod_files = None
+    all_staged_files = None
+    all_tracked_files = None
     if(git_repo != None):
-        all_local_mod_files = [git_repo.working_tree_dir + "/" + diff.a_path for diff in git_repo.index.diff(None)]
-        all_local_mod_files.extend([git_repo.working_tree_dir + "/" + diff.b_path for diff in git_repo.index.diff(None)])
-        all_local_mod_files = set(all_local_mod_files)
+        # Paths from git are relative to the top of the working tree
+        prefix = git_repo.working_tree_dir + "/"
+
+        # One 'git status' call covers both locally-modified and staged files:
+        # in each 'XY path' entry, X is the index state and Y the work-tree state
+        local_mod_paths = []
+        staged_paths = []
+        entries = iter(git_repo.git.status("--porcelain=v1", "-z", "--untracked-files=no").split("\0"))
+        for entry in entries:
+            if not entry:
+                continue
+            x, y, paths = entry[0], entry[1], [entry[3:]]
+            # Renames and copies are followed by a second entry, the original path
+            if x in "RC" or y in "RC":
+                paths.append(next(entries))
+            if x not in " ?!":
+                staged_paths.extend(paths)
+            if y not in " ?!":
+                local_mod_paths.extend(paths)
+
+        all_local_mod_files = frozenset(prefix + path for path in local_mod_paths)
         vlog(f"Repo shows {len(all_local_mod_files)} locally-modified files")
 
-    all_staged_files = None
-    if(git_repo != None):
-        all_staged_files = [git_repo.working_tree_dir + "/" + diff.a_path for diff in git_repo.index.diff("HEAD")]
-        all_staged_files.extend([git_repo.working_tree_dir + "/" + diff.b_path for diff in git_repo.index.diff("HEAD")])
-        all_staged_files = set(all_staged_files)
+        all_staged_files = frozenset(prefix + path for path in staged_paths)
         vlog(f"Repo shows {len(all_staged_files)} staged files with changes")
 
-    all_tracked_files = None
-    if(git_repo != None):
-        all_tracked_files = [entry.abspath for entry in git_repo.commit().tree.traverse()]
-        # This would almost work, and may be faster
-        # all_tracked_files = git_repo.git.ls_files().split()
+        all_tracked_files = frozenset(prefix + path for path in git_repo.git.ls_files("-z").split("\0") if path)
         vlog(f"Repo shows {len(all_tracked_files)} total files tracked in repo")
 
-    rows = []
-    for p in root.rglob('*'):
-        # Following block only involves info in filesystem metadata (FAT)
-        try:
-            if not p.is_file():
-                continue
-            st = p.stat()
-        except (OSError, PermissionError) as e:
-            # skip unreadable entries
-            vlog(f"skipping unreadable entry: {p} ({e})")
-            continue
-
-        # Following block involves info against cached git-repo data
-        b_tracked = False
-        if(git_repo and p.name in all_tracked_files):
-            b_tracked = True
-
-        b_local_mod = False
-        if(git_repo and p.name in all_local_mod_files ):
-            b_local_mod = True
-
-        b_staged = False
-        if(git_repo and p.name in all_staged_files ):
-            b_staged = True
-
-        # Define "plaintext files" by suffix
-        plaintext_suffixes = {'.4gl', '.ext', '.org', '.sql', '.set', '.RDS',
-            '.txt', '.md', '.csv', '.json', '.yaml', '.yml', '.ini', '.cfg',
-            '.py', '.pl', '.sh', '.bash', '.ksh', '.c', '.h', '.cpp', '.hpp',
-            '.js', '.ts', '.html', '.css', '.xml', '.bat', '.cmd', '.php'}
-
-        # Following block involves a full content-parse (intensive)
-        n_lines = 0
-        n_comment_lines = 0
-        n_blank_lines = 0
-        n_function_defines= 0
-        n_prepare_defines= 0
-        n_execute_statements= 0
-        n_run_statements= 0
-        n_mz_statements= 0
-        if p.suffix.lower() in plaintext_suffixes or p.name == "Makefile":
-            try:
-                with p.open("r", encoding="utf-8", errors="ignore") as f:
-                    for line in f:
-                        n_lines += 1
-                        if re.search(r'^\s*#.*', line, re.IGNORECASE):
-                            # Considering Copyright-related lines as "blank", not "comment"
-                            if (re.search(r'Copyright', line, re.IGNORECASE) or
-                                re.search(r'All rights reserved', line, re.IGNORECASE) or
-                                re.search(r'Use, modification', line, re.IGNORECASE) or
-                                re.search(r'software is limit', line, re.IGNORECASE)):
-                                n_blank_lines += 1
-                            # Considering lines with just # as "blank"
-                            elif re.search(r'^\s*#+$', line, re.IGNORECASE):
-                                n_blank_lines += 1 #101
-                            # All else of this match are (useful) comments
-                            # This includes code with comments appended per
-                            # European Cooperation for Space Standardization
-                            # (ECSS)
-                            else:
-                                n_comment_lines += 1
-                        # Considering empty or lines with just whitespace as "blank"
-                        if re.search(r'^\w*$', line, re.IGNORECASE):
-                            n_blank_lines += 1
-                        # Code lines that have a comment appended at the end
-                        if re.search(r'^[^#]+#+\s*\W.*$', line, re.IGNORECASE):
-                            n_comment_lines += 1
-                        # XXX   Refactor to categorize the kinds of statements
-                        #       (auth, time-consuming, risk, etc.), and allow
-                        #       them to be configurable
-                        if re.search(r'.*function\s+\w+\(.*\)', line, re.IGNORECASE):
-                            n_function_defines += 1
-                        if re.search(r'.*prepare\s+\w+\s+from', line, re.IGNORECASE):
-                            n_prepare_defines += 1
-                        if re.search(r'.*execute\s+\w+\s+using', line, re.IGNORECASE):
-                            n_execute_statements += 1
-                        if re.search(r'.*run\s+', line, re.IGNORECASE):
-                            n_run_statements += 1
-                        if re.search(r'.*mz\s+', line, re.IGNORECASE):
-                            n_mz_statements += 1
-            except Exception as e:
-                vlog(f"could not count lines in {p}: {e}")
-
-        rows.append({
-            "abs_path": str(p),
-            "rel_path": str(p.relative_to(root)),
-            "parent": str(p.parent.relative_to(root)),
-            "name": p.name,
-            "suffix": p.suffix,
-            "size_bytes": st.st_size,
-            "mtime": iso(st.st_mtime),
-            "ctime": iso(st.st_ctime),
-            "atime": iso(st.st_atime),
-            "mode_octal": oct(st.st_mode & 0o777),
-            "uid": st.st_uid,
-            "gid": st.st_gid,
-            "num_lines": n_lines,
-            "num_comment_lines": n_comment_lines,
-            "num_blank_lines": n_blank_lines,
-            "num_function_defines": n_function_defines,
-            "num_prepare_defines": n_prepare_defines,
-            "num_execute_statements": n_execute_statements,
-            "num_run_statements": n_run_statements,
-            "num_mz_statements": n_mz_statements,
-            "b_tracked_in_scm_repo": b_tracked,
-            "b_locally_modified": b_local_mod,
-            "b_staged_for_commit": b_staged,
-        })
-    df = pd.DataFrame(rows)
+    # Gather straight into one list per column rather than a dict per row
+    data = {name: [] for name in COLUMNS}
+    columns = list(data.values())
+    max_workers = os.cpu_count() or 1
+    # Workers come from a fresh server process (or are spawned), never forked
+    # from this one, so none can inherit a lock held by the walker thread
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=scan_mp_context(),
+            initializer=init_scan_worker,
+            initargs=(VERBOSE, all_tracked_files, all_local_mod_files, all_staged_files)) as executor:
+        # The directory walk runs in its own thread, feeding a bounded queue, so
+        # workers start parsing content while the walk is still under way
+        files = queue.Queue(maxsize=WALK_QUEUE_DEPTH)
+        walker = threading.Thread(target=queue_files, args=(str(root), files), daemon=True)
+        walker.start()
+
+        pending = set()
+        for batch in queued_batches(files):
+            pending.add(executor.submit(scan_batch, batch))
+            # Bound the batches in flight, collecting results as they finish
+            if len(pending) >= 2 * max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    extend_columns(columns, future.result())
+        for future in pending:
+            extend_columns(columns, future.result())
+    walker.join()
+    df = pd.DataFrame(data)
+    # Raw epoch-ns timestamps become local-time datetimes in one pass per column
+    for col in ("mtime", "ctime", "atime"):
+        df[col] = (pd.to_datetime(df[col], unit="ns", utc=True)
+                   .dt.tz_convert(tzlocal()).dt.tz_localize(None).dt.floor("us"))
+    # Low-cardinality string columns are stored as categoricals (int codes plus
+    # a small dictionary), which also lets the sort below work on the codes
+    for col in ("parent", "suffix", "mode_octal"):
+        df[col] = df[col].astype("category")
+    # Per-file strings go into Arrow string arrays (one buffer plus offsets)
+    # rather than an array of Python objects
+    for col in ("abs_path", "rel_path", "name"):
+        df[col] = df[col].astype("string[pyarrow]")
     if not df.empty:
         df = df.sort_values(["parent", "name"]).reset_index(drop=True)
     return df
 
+def open_parquet_writer(out_path: Path, df: pd.DataFrame):
+    "Open a Parquet writer at out_path with a schema taken from df."
+    schema = pa.Table.from_pandas(df.iloc[:0], preserve_index=False).schema
+    # Categorical codes are as narrow as each module's category count
+    # allows; widen them so later modules with more categories still fit
+    schema = pa.schema([pa.field(f.name, pa.dictionary(pa.int32(), f.type.value_type))
+                        if pa.types.is_dictionary(f.type) else f
+                        for f in schema], metadata=schema.metadata)
+    return pq.ParquetWriter(str(out_path), schema,
+                            compression='zstd', compression_level=3)
+
+def write_parquet_part(writer, df: pd.DataFrame) -> int:
+    """Append df through writer in row groups of at most PARQUET_ROW_GROUP_ROWS;
+    returns the number of row groups written."""
+    # Converted a row group at a time, so only one slice of df is ever
+    # held as an Arrow table; an empty df still writes one (empty) group
+    starts = range(0, max(len(df), 1), PARQUET_ROW_GROUP_ROWS)
+    for start in starts:
+        table = pa.Table.from_pandas(df.iloc[start:start + PARQUET_ROW_GROUP_ROWS], preserve_index=False)
+        writer.write_table(table.cast(writer.schema))
+    return len(starts)
+
+def parquet_to_csv(writer, out_path: Path, row_groups: int, csv_path: Path) -> bool:
+    """After a failed Parquet write, close writer and move the first
+    row_groups (those of fully written modules) into a new CSV at csv_path,
+    a row group at a time; the Parquet file is then removed. Returns whether
+    any rows (and so the CSV header) were written."""
+    try:
+        if writer is not None:
+            writer.close()
+        if row_groups:
+            written = pq.ParquetFile(str(out_path))
+            for i in range(row_groups):
+                written.read_row_group(i).to_pandas().to_csv(
+                    str(csv_path), mode='a' if i else 'w', header=not i, index=False)
+    finally:
+        out_path.unlink(missing_ok=True)
+    return bool(row_groups)
+
 def main(argv=None):
     p = argparse.ArgumentParser(description="Create a DataFrame of stats for one or more module directories.")
     p.add_argument("roots", nargs="*", help="Module directories to scan (default: audittest.4gm)")
@@ -179,54 +413,87 @@ def main(argv=None):
     VERBOSE = bool(args.verbose)
 
     roots = args.roots or ["audittest.4gm"]
-    all_dfs = []
+    scanned = 0
     total_files = 0
 
+    # Output is streamed a module at a time, through one Parquet writer or by
+    # appending to the CSV file, rather than concatenating every module first
+    out_path = Path(args.out) if args.out else None
+    to_parquet = out_path is not None and out_path.suffix.lower() in ('.parquet', '.pq')
+    writer = None
+    row_groups = 0
+    csv_started = False
+
     whole = len(roots)
     part = 0
-    for root_str in roots:
-        part += 1
-        root = Path(root_str)
-        if not root.exists() or not root.is_dir():
-            print("ERROR: root directory not found or not a directory:", root, file=sys.stderr)
-            continue
-
-        df = gather_stats(root, args.nogit)
-        count = len(df)
-        total_files += count
-        if count:
-            df['module'] = root.name
-        all_dfs.append(df)
-
-        print(f"scanned: {root}, {part} of {whole}")
-        print(f"files found: {count}")
-        print(f"Printing <=8 example rows:")
-        if count:
-            pd.set_option("display.max_rows", 10)
-            print(df.head(8).to_string(index=False))
-
-    if not all_dfs:
+    try:
+        for root_str in roots:
+            part += 1
+            root = Path(root_str)
+            if not root.exists() or not root.is_dir():
+                print("ERROR: root directory not found or not a directory:", root, file=sys.stderr)
+                continue
+
+            df = gather_stats(root, args.nogit)
+            scanned += 1
+            count = len(df)
+            total_files += count
+            if count:
+                df['module'] = pd.Categorical([root.name] * count)
+
+            print(f"scanned: {root}, {part} of {whole}")
+            print(f"files found: {count}")
+            print(f"Printing <=8 example rows:")
+            if count:
+                pd.set_option("display.max_rows", 10)
+                print(df.head(8).to_string(index=False))
+
+            if to_parquet and count:
+                try:
+                    if writer is None:
+                        writer = open_parquet_writer(out_path, df)
+                    row_groups += write_parquet_part(writer, df)
+                except Exception as e:
+                    # Keep one complete output: modules already written move
+                    # from the Parquet file to CSV, and this one and the rest
+                    # follow them there
+                    print("ERROR writing Parquet:", e, file=sys.stderr)
+                    csv_path = out_path.with_suffix('.csv')
+                    print(f"Parquet write failed; falling back to CSV: {csv_path}", file=sys.stderr)
+                    csv_started = parquet_to_csv(writer, out_path, row_groups, csv_path)
+                    writer = None
+                    to_parquet = False
+                    out_path = csv_path
+            if out_path is not None and not to_parquet and count:
+                df.to_csv(str(out_path), mode='a' if csv_started else 'w', header=not csv_started, index=False)
+                csv_started = True
+    except BaseException:
+        # Never leave a partial Parquet file (or one without its footer) behind
+        if to_parquet:
+            try:
+                if writer is not None:
+                    writer.close()
+            finally:
+                out_path.unlink(missing_ok=True)
+        raise
+
+    if not scanned:
         print("No valid modules scanned.", file=sys.stderr)
         sys.exit(2)
 
-    if args.out:
-        out_path = Path(args.out)
-        combined = pd.concat(all_dfs, ignore_index=True)
-        suffix = out_path.suffix.lower()
-        if suffix in ('.parquet', '.pq'):
-            # attempt parquet write; if engine missing, fall back to CSV
-            try:
-                combined.to_parquet(str(out_path), index=False)
-                print("wrote:", out_path)
-            except Exception as e:
-                print("ERROR writing Parquet:", e, file=sys.stderr)
-                print("Parquet engine not available or write failed; falling back to CSV.", file=sys.stderr)
-                csv_path = out_path.with_suffix('.csv')
-                combined.to_csv(str(csv_path), index=False)
-                print("wrote:", csv_path)
-        else:
-            combined.to_csv(str(out_path), index=False)
-            print("wrote:", out_path)
+    if to_parquet:
+        if writer is None:
+            # No files found in any module; still leave an (empty) Parquet file
+            empty = pd.DataFrame(columns=[*COLUMNS, "module"])
+            writer = open_parquet_writer(out_path, empty)
+            write_parquet_part(writer, empty)
+        writer.close()
+        print("wrote:", out_path)
+    elif out_path is not None:
+        if not csv_started:
+            # No files found in any module; still leave a header-only CSV file
+            pd.DataFrame(columns=[*COLUMNS, "module"]).to_csv(str(out_path), index=False)
+        print("wrote:", out_path)
 
     print("total files across modules:", total_files)
 